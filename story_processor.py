@@ -1,9 +1,13 @@
+import os
 import sys
 import re
 import csv
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 from loguru import logger
+import mutagen
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(PROJECT_ROOT))
@@ -24,11 +28,37 @@ logger.add(
 )
 
 
+# Word lengths reported in the CSV, paired with their column names
+WORD_LENGTH_COLUMNS = tuple(
+    (length, f"{length}_letter_words") for length in range(3, 11)
+)
+
+
+# Analysis-only engine of an analysis worker process; load_models() is
+# never called there, so no Whisper model is loaded per worker
+_analysis_engine = None
+
+
+def _init_analysis_worker():
+    global _analysis_engine
+    _analysis_engine = WhisperNLP(AudioNLPConfig())
+
+
+def _analyze(text: str) -> dict:
+    return _analysis_engine.analyze(text)
+
+
 class StoryProcessorConfig:
     def __init__(self):
         self.base_dir = Path(__file__).resolve().parent
         self.local_audio_dir = self.base_dir / "audio_inputs"
         self.output_csv = self.base_dir / "stories_analysis.csv"
+        # Number of audios handed to Whisper in one forward pass
+        self.batch_size = 8
+        # Number of CSV rows buffered before they are written out
+        self.write_batch_size = 16
+        # Processes running text analysis alongside transcription
+        self.analysis_workers = min(4, os.cpu_count() or 1)
 
 
 class StoryProcessor:
@@ -43,6 +73,7 @@ class StoryProcessor:
         self.nlp_engine.load_models()
 
         self.writer = ResultWriter(self.config.output_csv)
+        self.pending_rows = []
 
         # Load already processed audios from CSV
         self.processed_audios = self._load_processed_audios()
@@ -53,9 +84,17 @@ class StoryProcessor:
 
         if self.config.output_csv.exists():
             with self.config.output_csv.open(newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    processed.add(row["audio_file"])
+                reader = csv.reader(f)
+                header = next(reader, None)
+
+                if header and "audio_file" not in header:
+                    logger.error(
+                        f"{self.config.output_csv.name} has no audio_file "
+                        "column, cannot tell which audios were processed"
+                    )
+                elif header:
+                    idx = header.index("audio_file")
+                    processed = {row[idx] for row in reader if len(row) > idx}
 
             logger.info(f"Loaded {len(processed)} already processed audios")
 
@@ -67,52 +106,221 @@ class StoryProcessor:
             if p.suffix.lower() in {".mp3", ".wav", ".m4a"}
         ])
 
-    def process_audio(self, audio_path: Path):
+    def audio_duration(self, audio_path: Path):
+        """Duration in seconds from the file header, None if unknown"""
         try:
+            audio = mutagen.File(str(audio_path))
+        except Exception:
+            return None
 
-            if audio_path.name in self.processed_audios:
-                logger.info(f"Skipping (already analyzed): {audio_path.name}")
-                return
+        if audio is None or not audio.info.length:
+            return None
 
-            logger.info(f"Processing audio: {audio_path.name}")
+        return audio.info.length
 
-            transcript_path = (
-                self.audio_manager.config.transcript_dir
-                / f"{audio_path.stem}.txt"
-            )
+    def length_sort_key(self, audio_path: Path) -> tuple:
+        """Sort by duration; audios without one go last, ordered by size"""
+        duration = self.audio_duration(audio_path)
+        if duration is not None:
+            return (False, duration)
 
-            if transcript_path.exists():
-                logger.info(f"Using existing transcript: {transcript_path.name}")
-                text = transcript_path.read_text(encoding="utf-8")
+        try:
+            return (True, audio_path.stat().st_size)
+        except OSError:
+            # Missing or unreadable files fail later on their own
+            return (True, 0)
+
+    def sort_by_duration(self, audio_files: list) -> list:
+        """Order audios so that clips of similar length share a batch"""
+        # Cached transcripts never reach Whisper, so they need no probing
+        cached, uncached = [], []
+        for audio_path in audio_files:
+            if self._transcript_path(audio_path).exists():
+                cached.append(audio_path)
             else:
-                transcription = self.nlp_engine.transcribe(audio_path)
+                uncached.append(audio_path)
+
+        keys = {p: self.length_sort_key(p) for p in uncached}
+
+        unknown = sum(no_duration for no_duration, _ in keys.values())
+        if unknown:
+            logger.warning(
+                f"Could not read duration of {unknown} audios, "
+                "batching them by file size"
+            )
+
+        # Stable sort keeps name order among equal lengths
+        by_length = sorted(uncached, key=keys.__getitem__)
+
+        return cached + by_length
+
+    def batch_audio_files(self, audio_files: list) -> list:
+        """Group audios of similar length into batches to minimize padding"""
+        if getattr(self.nlp_engine, "transcribe_batch", None) is None:
+            # Engine transcribes one audio at a time, so order buys nothing
+            ordered = audio_files
+        else:
+            ordered = self.sort_by_duration(audio_files)
+
+        size = self.config.batch_size
+
+        return [
+            ordered[i:i + size]
+            for i in range(0, len(ordered), size)
+        ]
+
+    def _transcript_path(self, audio_path: Path) -> Path:
+        return (
+            self.audio_manager.config.transcript_dir
+            / f"{audio_path.stem}.txt"
+        )
+
+    def load_batch_transcripts(self, audio_paths: list) -> dict:
+        """Batch-transcribe uncached audios, return {audio_path: text}
+
+        Uses the engine's optional transcribe_batch(paths) hook, which must
+        return a sequence of {"text": ...} dicts, one per input path and in
+        input order. Audios missing from the result (cached, failed, or no
+        batch hook on the engine) are handled by load_transcript.
+        """
+        texts = {}
+        pending = [
+            audio_path for audio_path in audio_paths
+            if not self._transcript_path(audio_path).exists()
+        ]
+
+        if not pending:
+            return texts
+
+        engine_batch = getattr(self.nlp_engine, "transcribe_batch", None)
+        if engine_batch is None:
+            return texts
+
+        try:
+            transcriptions = list(engine_batch(pending))
+        except Exception:
+            logger.exception(
+                f"Batch transcription failed for {len(pending)} audios, "
+                "falling back to one at a time"
+            )
+            return texts
+
+        if len(transcriptions) != len(pending):
+            logger.error(
+                f"Batch transcription returned {len(transcriptions)} results "
+                f"for {len(pending)} audios, falling back to one at a time"
+            )
+            return texts
+
+        for audio_path, transcription in zip(pending, transcriptions):
+            try:
                 text = transcription["text"]
-                transcript_path.write_text(text, encoding="utf-8")
-
-            analysis = self.nlp_engine.analyze(text)
-
-            row = {
-                "audio_file": audio_path.name,
-                "word_count": analysis["word_count"],
-                "sentence_count": analysis["sentence_count"],
-                "avg_words_per_sentence": analysis["avg_words_per_sentence"],
-                "noun_count": analysis["pos_counts"]["nouns"],
-                "verb_count": analysis["pos_counts"]["verbs"],
-                "adj_count": analysis["pos_counts"]["adjectives"],
-            }
-
-            for length in range(3, 11):
-                row[f"{length}_letter_words"] = (
-                    analysis["word_length_distribution"].get(length, 0)
+                self._transcript_path(audio_path).write_text(text, encoding="utf-8")
+            except Exception:
+                logger.exception(
+                    f"Bad batch transcription for {audio_path.name}, "
+                    "falling back to single transcription"
                 )
+                continue
+
+            texts[audio_path] = text
+
+        return texts
+
+    def load_transcript(self, audio_path: Path) -> str:
+        """Return the cached transcript, transcribing the audio if needed"""
+        transcript_path = self._transcript_path(audio_path)
+
+        if transcript_path.exists():
+            logger.info(f"Using existing transcript: {transcript_path.name}")
+            return transcript_path.read_text(encoding="utf-8")
+
+        transcription = self.nlp_engine.transcribe(audio_path)
+        text = transcription["text"]
+        transcript_path.write_text(text, encoding="utf-8")
+        return text
+
+    def build_row(self, audio_path: Path, analysis: dict) -> dict:
+        row = {
+            "audio_file": audio_path.name,
+            "word_count": analysis["word_count"],
+            "sentence_count": analysis["sentence_count"],
+            "avg_words_per_sentence": analysis["avg_words_per_sentence"],
+            "noun_count": analysis["pos_counts"]["nouns"],
+            "verb_count": analysis["pos_counts"]["verbs"],
+            "adj_count": analysis["pos_counts"]["adjectives"],
+        }
+
+        distribution = analysis["word_length_distribution"]
+        row.update(
+            (column, distribution.get(length, 0))
+            for length, column in WORD_LENGTH_COLUMNS
+        )
+
+        return row
+
+    def add_row(self, row: dict):
+        self.pending_rows.append(row)
+        self.processed_audios.add(row["audio_file"])
+
+        if len(self.pending_rows) >= self.config.write_batch_size:
+            self.flush_rows()
+
+    def submit_analyses(self, batch: list, texts: dict, pool, pbar) -> list:
+        """Queue analysis of a transcribed batch, return (audio, future) pairs"""
+        submitted = []
+
+        for audio in batch:
+            try:
+                logger.info(f"Processing audio: {audio.name}")
+                text = texts.get(audio)
+                if text is None:
+                    text = self.load_transcript(audio)
+                future = pool.submit(_analyze, text)
+            except Exception:
+                logger.exception(f"Failed audio: {audio.name}")
+                pbar.update(1)
+                continue
+
+            submitted.append((audio, future))
+
+        return submitted
+
+    def finish_analyses(self, submitted: list, pbar):
+        for audio, future in submitted:
+            try:
+                self.add_row(self.build_row(audio, future.result()))
+                logger.success(f"Done: {audio.name}")
+            except Exception:
+                logger.exception(f"Failed audio: {audio.name}")
+
+            pbar.update(1)
+
+    def flush_rows(self):
+        """Write buffered rows to the CSV, one row at a time if batching fails"""
+        if not self.pending_rows:
+            return
 
-            self.writer.write_row(row)
-            self.processed_audios.add(audio_path.name)
+        rows, self.pending_rows = self.pending_rows, []
 
-            logger.success(f"Done: {audio_path.name}")
+        write_rows = getattr(self.writer, "write_rows", None)
+        if write_rows is not None:
+            try:
+                write_rows(rows)
+                return
+            except Exception:
+                logger.exception(
+                    f"Failed writing {len(rows)} CSV rows at once, "
+                    "retrying one at a time"
+                )
 
-        except Exception:
-            logger.exception(f"Failed audio: {audio_path.name}")
+        for row in rows:
+            try:
+                self.writer.write_row(row)
+            except Exception:
+                logger.exception(
+                    f"Failed writing CSV row for: {row['audio_file']}"
+                )
 
     def run(self):
         audio_files = self.list_audio_files()
@@ -121,8 +329,37 @@ class StoryProcessor:
             logger.warning("No audio files found")
             return
 
-        for audio in tqdm(audio_files, desc="Processing audios"):
-            self.process_audio(audio)
+        pending = []
+        for audio in audio_files:
+            if audio.name in self.processed_audios:
+                logger.info(f"Skipping (already analyzed): {audio.name}")
+            else:
+                pending.append(audio)
+
+        # Analysis of one batch runs in worker processes while the next batch
+        # is transcribed; spawn avoids forking a process that holds CUDA state
+        analysis_pool = ProcessPoolExecutor(
+            max_workers=self.config.analysis_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_analysis_worker,
+        )
+        in_flight = []
+
+        try:
+            with tqdm(total=len(pending), desc="Processing audios") as pbar:
+                for batch in self.batch_audio_files(pending):
+                    texts = self.load_batch_transcripts(batch)
+                    submitted = self.submit_analyses(
+                        batch, texts, analysis_pool, pbar
+                    )
+
+                    self.finish_analyses(in_flight, pbar)
+                    in_flight = submitted
+
+                self.finish_analyses(in_flight, pbar)
+        finally:
+            analysis_pool.shutdown(wait=True)
+            self.flush_rows()
 
         logger.success("All local audios processed")
 
@@ -0,0 +1,56 @@
+"""Stand-in for the external speech_tool package, used by the tests
+
+Lives in its own module so spawned analysis workers can import it too.
+"""
+import csv
+
+
+class AudioNLPConfig:
+    transcript_dir = None
+
+
+class AudioManager:
+    def __init__(self, config):
+        self.config = config
+
+
+class WhisperNLP:
+    """Engine whose batch results are scripted per test"""
+
+    batch_results = None
+
+    def __init__(self, config):
+        self.single_calls = []
+
+    def load_models(self):
+        pass
+
+    def transcribe(self, audio_path):
+        self.single_calls.append(audio_path.name)
+        return {"text": f"single {audio_path.stem}"}
+
+    def transcribe_batch(self, audio_paths):
+        return self.batch_results(audio_paths)
+
+    def analyze(self, text):
+        words = text.split()
+        return {
+            "word_count": len(words),
+            "sentence_count": 1,
+            "avg_words_per_sentence": len(words),
+            "pos_counts": {"nouns": 0, "verbs": 0, "adjectives": 0},
+            "word_length_distribution": {},
+        }
+
+
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+
+    def write_row(self, row):
+        new_file = not self.path.exists()
+        with self.path.open("a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(row))
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
@@ -0,0 +1,202 @@
+import csv
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from speech_tool import (  # noqa: E402
+    AudioNLPConfig as StubConfig,
+    ResultWriter as StubResultWriter,
+    WhisperNLP as StubWhisperNLP,
+)
+
+import story_processor  # noqa: E402
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    audio_dir = tmp_path / "audio_inputs"
+    audio_dir.mkdir()
+    transcript_dir = tmp_path / "transcripts"
+    transcript_dir.mkdir()
+
+    for name in ("a0.mp3", "a1.mp3", "a2.mp3"):
+        (audio_dir / name).write_bytes(b"")
+
+    class Config(story_processor.StoryProcessorConfig):
+        def __init__(self):
+            super().__init__()
+            self.local_audio_dir = audio_dir
+            self.output_csv = tmp_path / "stories_analysis.csv"
+
+    monkeypatch.setattr(story_processor, "StoryProcessorConfig", Config)
+    monkeypatch.setattr(StubConfig, "transcript_dir", transcript_dir)
+
+    return story_processor.StoryProcessor()
+
+
+def read_csv(processor):
+    with processor.config.output_csv.open(newline="", encoding="utf-8") as f:
+        return {row["audio_file"]: row for row in csv.DictReader(f)}
+
+
+def test_bad_batch_result_falls_back_to_single_transcription(processor):
+    def batch_results(audio_paths):
+        return [
+            {"text": None} if p.name == "a1.mp3" else {"text": "batch ok"}
+            for p in audio_paths
+        ]
+
+    processor.nlp_engine.batch_results = batch_results
+    processor.run()
+
+    rows = read_csv(processor)
+    assert sorted(rows) == ["a0.mp3", "a1.mp3", "a2.mp3"]
+    assert processor.nlp_engine.single_calls == ["a1.mp3"]
+    assert rows["a1.mp3"]["word_count"] == "2"
+
+
+def test_batch_result_count_mismatch_falls_back_for_whole_batch(processor):
+    processor.nlp_engine.batch_results = lambda paths: [{"text": "only one"}]
+    processor.run()
+
+    assert sorted(read_csv(processor)) == ["a0.mp3", "a1.mp3", "a2.mp3"]
+    assert sorted(processor.nlp_engine.single_calls) == [
+        "a0.mp3", "a1.mp3", "a2.mp3"
+    ]
+
+
+def test_failed_row_write_does_not_drop_later_rows(processor, monkeypatch):
+    processor.nlp_engine.batch_results = (
+        lambda paths: [{"text": "batch ok"} for _ in paths]
+    )
+    write_row = StubResultWriter.write_row
+
+    def flaky_write_row(self, row):
+        if row["audio_file"] == "a0.mp3":
+            raise OSError("disk full")
+        write_row(self, row)
+
+    monkeypatch.setattr(StubResultWriter, "write_row", flaky_write_row)
+    processor.run()
+
+    assert sorted(read_csv(processor)) == ["a1.mp3", "a2.mp3"]
+
+
+def test_batches_sorted_by_duration_without_probing_cached(
+    processor, monkeypatch
+):
+    durations = {"a0.mp3": 30.0, "a1.mp3": 5.0, "a2.mp3": None}
+    probed = []
+
+    def audio_duration(audio_path):
+        probed.append(audio_path.name)
+        return durations[audio_path.name]
+
+    monkeypatch.setattr(processor, "audio_duration", audio_duration)
+    (processor.audio_config.transcript_dir / "a2.txt").write_text("cached")
+    (processor.config.local_audio_dir / "a3.mp3").write_bytes(b"")
+    durations["a3.mp3"] = 12.0
+    processor.config.batch_size = 2
+
+    batches = processor.batch_audio_files(processor.list_audio_files())
+
+    assert [[p.name for p in batch] for batch in batches] == [
+        ["a2.mp3", "a1.mp3"], ["a3.mp3", "a0.mp3"]
+    ]
+    assert sorted(probed) == ["a0.mp3", "a1.mp3", "a3.mp3"]
+
+
+def test_no_duration_probing_when_engine_cannot_batch(processor, monkeypatch):
+    monkeypatch.delattr(StubWhisperNLP, "transcribe_batch")
+    monkeypatch.setattr(
+        processor, "audio_duration", lambda p: pytest.fail("probed duration")
+    )
+
+    processor.run()
+
+    assert processor.nlp_engine.single_calls == ["a0.mp3", "a1.mp3", "a2.mp3"]
+    assert sorted(read_csv(processor)) == ["a0.mp3", "a1.mp3", "a2.mp3"]
+
+
+def test_unreadable_cached_transcript_fails_only_that_audio(
+    processor, monkeypatch
+):
+    monkeypatch.delattr(StubWhisperNLP, "transcribe_batch")
+    (processor.audio_config.transcript_dir / "a1.txt").write_bytes(b"\xff\xfe\xfa")
+
+    processor.run()
+
+    assert sorted(read_csv(processor)) == ["a0.mp3", "a2.mp3"]
+
+
+def test_audio_removed_after_listing_does_not_abort_batching(processor):
+    audio_files = processor.list_audio_files()
+    audio_files[1].unlink()
+
+    batches = processor.batch_audio_files(audio_files)
+
+    assert sorted(p.name for batch in batches for p in batch) == [
+        "a0.mp3", "a1.mp3", "a2.mp3"
+    ]
+
+
+def test_rows_written_once_across_batches_and_flushes(processor):
+    for name in ("a3.mp3", "a4.mp3"):
+        (processor.config.local_audio_dir / name).write_bytes(b"")
+    processor.nlp_engine.batch_results = (
+        lambda paths: [{"text": f"batch {p.stem}"} for p in paths]
+    )
+    processor.config.batch_size = 2
+    processor.config.write_batch_size = 2
+
+    processor.run()
+
+    with processor.config.output_csv.open(newline="", encoding="utf-8") as f:
+        written = sorted(row["audio_file"] for row in csv.DictReader(f))
+
+    assert written == ["a0.mp3", "a1.mp3", "a2.mp3", "a3.mp3", "a4.mp3"]
+    assert processor.pending_rows == []
+
+
+def test_failed_write_rows_falls_back_to_single_rows(processor, monkeypatch):
+    processor.nlp_engine.batch_results = (
+        lambda paths: [{"text": "batch ok"} for _ in paths]
+    )
+
+    def write_rows(self, rows):
+        raise OSError("batch write failed")
+
+    monkeypatch.setattr(StubResultWriter, "write_rows", write_rows, raising=False)
+    processor.run()
+
+    assert sorted(read_csv(processor)) == ["a0.mp3", "a1.mp3", "a2.mp3"]
+
+
+def test_resume_skips_audios_already_in_csv(processor):
+    processor.config.output_csv.write_text(
+        "audio_file,word_count\na0.mp3,1\na2.mp3,1\n", encoding="utf-8"
+    )
+    processor.nlp_engine.batch_results = (
+        lambda paths: [{"text": "batch ok"} for _ in paths]
+    )
+
+    resumed = story_processor.StoryProcessor()
+    assert resumed.processed_audios == {"a0.mp3", "a2.mp3"}
+
+    resumed.nlp_engine.batch_results = processor.nlp_engine.batch_results
+    resumed.run()
+
+    with resumed.config.output_csv.open(newline="", encoding="utf-8") as f:
+        written = [row["audio_file"] for row in csv.DictReader(f)]
+
+    assert written == ["a0.mp3", "a2.mp3", "a1.mp3"]
+
+
+def test_csv_without_audio_file_column_loads_nothing(processor):
+    processor.config.output_csv.write_text("word_count\n1\n", encoding="utf-8")
+
+    assert story_processor.StoryProcessor().processed_audios == set()